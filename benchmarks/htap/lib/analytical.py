@@ -42,7 +42,7 @@ QUERY_TEMPLATES = {
     22: Template(open(path.join(TEMPLATE_DIR, '22.sql.template'), 'r').read()),
 }
 
-QUERY_IDS = sorted(QUERY_TEMPLATES.keys())
+QUERY_IDS = tuple(sorted(QUERY_TEMPLATES.keys()))
 
 def is_ignored_query(ignored_queries, query_id):
     return (str(query_id) in ignored_queries)
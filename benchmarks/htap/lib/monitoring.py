@@ -1,11 +1,37 @@
-from dateutil.relativedelta import relativedelta
+import sys
+
+from calendar import monthrange
+from datetime import date
 from math import trunc
 from tabulate import tabulate
 
 from benchmarks.htap.lib.analytical import QUERY_IDS
-from benchmarks.htap.lib.helpers import WAREHOUSES_SF_RATIO
+from benchmarks.htap.lib.helpers import WANTED_RANGE, WAREHOUSES_SF_RATIO
 from benchmarks.htap.lib.stats import QUERY_TYPES
 
+# formats the LAST, MIN, AVG and MAX columns of the OLTP table
+_format_oltp_values = '{:5} | {:5} | {:5} | {:5}'.format
+
+# terminal control sequences to redraw the display in place
+_NL = b'\n'
+_CURSOR_UP_LINES = b'\033[%dF'
+_CLEAR_LINE = b'\033[2K'
+_CLEAR_TO_END = b'\033[J'
+
+def _add_months(start, months):
+    year, month = divmod(start.year * 12 + start.month - 1 + months, 12)
+    return date(year, month + 1, min(start.day, monthrange(year, month + 1)[1]))
+
+def _date_range(start, end):
+    # years, months and days from start to end, computed like dateutil's relativedelta
+    months = (end.year - start.year) * 12 + end.month - start.month
+    anchor = _add_months(start, months)
+    if anchor > end:
+        months -= 1
+        anchor = _add_months(start, months)
+    years, months = divmod(months, 12)
+    return years, months, (end - anchor).days
+
 class Monitor:
     def __init__(self, stats, num_oltp_workers, num_olap_workers, num_warehouses, min_timestamp):
         self.stats = stats
@@ -16,18 +42,45 @@ class Monitor:
         self.current_line = 0
         self.total_lines = 0
         self.min_timestamp = min_timestamp.date()
-        self.lines = []
+        # the frame is encoded line by line into one buffer that is written out as is
+        self._buf = bytearray()
+        self._last_fingerprint = None
+
+        # the dashboard chrome does not change between refreshes, so build it only once
+        self._colstore_header_lines = (
+            'Table size and S64 DA columnstore status',
+            '|    table     | heap size |  colstore |  ratio  | cached |',
+            '|---------------------------------------------------------|'
+        )
+        self._oltp_separator = '|' + '-' * 111 + '|'
+        self._oltp_subheader = ('|              |          |            |        '
+                                '|  LAST |  MIN  |  AVG  |  MAX  |  LAST |  MIN  |  AVG  |  MAX  |')
+        self._oltp_header = None
+        self._oltp_header_history_length = None
+        self._olap_header = (f'{"Stream":<8} |'
+                             + ''.join(f'{x:^10d} |' for x in range(1, num_olap_workers + 1))
+                             + f' {"#rows planned":13} | {"#rows processed":14} |')
+        self._olap_separator = '-' * len(self._olap_header)
+        self._olap_snapshot = []
 
     def _add_display_line(self, line):
-        self.lines.append(line)
+        self._buf += line.encode()
+        self._buf += _NL
+
+    def _write(self, data):
+        # anything printed before must not end up behind the display
+        sys.stdout.flush()
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
 
     def _print(self):
-        print(self.total_lines * '\033[F', end='')
-        for line in self.lines:
-            print('\033[2K', end='')
-            print(line)
-        self.total_lines = len(self.lines)
-        self.lines = []
+        # the whole frame reaches the terminal in a single write. Move the cursor back
+        # up over the previous frame and clear it with one escape each.
+        if self.total_lines:
+            self._buf[:0] = _CURSOR_UP_LINES % self.total_lines + _CLEAR_TO_END
+        self._write(self._buf)
+        self.total_lines = self._buf.count(_NL)
+        self._buf.clear()
 
     def display_summary(self, elapsed, burnin_duration):
         print()
@@ -66,23 +119,34 @@ class Monitor:
     def get_oltp_row(self, query_type = None):
         ok, err = self.stats.oltp_counts(query_type)
         tps, latency = self.stats.oltp_total(query_type)
-        tps     = '{:5} | {:5} | {:5} | {:5}'.format(*tps)
-        latency = '{:5} | {:5} | {:5} | {:5}'.format(*latency)
+        tps     = _format_oltp_values(*tps)
+        latency = _format_oltp_values(*latency)
         name = 'All types' if query_type == None else query_type
         return f'| {name:^12} | {ok+err:8} | {ok:10} | {err:6} | {tps} | {latency} |'
 
-    def get_olap_header(self):
-        olap_header = f'{"Stream":<8} |'
-        olap_header += ''.join([f'{x:^10d} |' for x in range(1, self.num_olap_workers + 1)])
-        olap_header += f' {"#rows planned":13} | {"#rows processed":14} |'
-        return olap_header
+    def get_oltp_header(self, history_length):
+        # the history only grows until it is full, so the header rarely needs a rebuild
+        if history_length != self._oltp_header_history_length:
+            self._oltp_header = ('|     TYPE     |  ISSUED  |  COMPLETED | ERRORS '
+                                 f'|         TPS (last {history_length}s)        '
+                                 f'|   LATENCY (last {history_length}s, in ms)   |')
+            self._oltp_header_history_length = history_length
+        return self._oltp_header
+
+    def _snapshot_olap(self):
+        # resolve the per-stream query stats once per refresh instead of once per table cell
+        olap_stats_for_stream_id = self.stats.olap_stats_for_stream_id
+        self._olap_snapshot = [
+            olap_stats_for_stream_id(stream_id)['queries']
+            for stream_id in range(self.num_olap_workers)
+        ]
 
     def get_olap_row(self, query_id):
         row = f'Query {query_id:2d} |'
         max_planned = 0
         max_processed = 0
-        for stream_id in range(self.num_olap_workers):
-            stats = self.stats.olap_stats_for_stream_id(stream_id).get('queries').get(query_id)
+        for queries in self._olap_snapshot:
+            stats = queries.get(query_id)
             if stats and stats['runtime'] > 0:
                 # output last result
                 max_planned = max(max_planned, int(stats['planned_rows']/1000))
@@ -99,60 +163,73 @@ class Monitor:
 
     def get_olap_sum(self):
         row = f'Total    |'
-        for stream_id in range(self.num_olap_workers):
-            stats = self.stats.olap_stats_for_stream_id(stream_id)
-            stream_sum = sum(stats['queries'][query_id]['runtime'] for query_id in QUERY_IDS)
+        for queries in self._olap_snapshot:
+            stream_sum = 0
+            for query_id in QUERY_IDS:
+                stream_sum += queries[query_id]['runtime']
             row += f' {stream_sum:9.2f} |'
         return row
 
     def get_columnstore_row(self, row):
         return f'| {row[0]:^12} | {row[1]:7.2f}GB | {row[2]:7.2f}GB | {row[3]:6.2f}x | {row[4]:4.2f}% |'
 
+    def get_elapsed_row(self, elapsed, burnin_duration):
+        htap_time = 0
+        if burnin_duration == None:
+            burnin_duration = elapsed
+        else:
+            htap_time = (elapsed - burnin_duration).total_seconds()
+        return f'Time elapsed: {elapsed.total_seconds():.0f}s | Burn-in: {burnin_duration.total_seconds():.0f}s | HTAP: {htap_time:.0f}s'
+
     def update_display(self, elapsed, burnin_duration, time_now, stats_conn, latest_timestamp):
         self.current_line = 0
 
+        # while no new stats arrived only the elapsed time on the last line changes
+        fingerprint = (self.stats.revision, latest_timestamp.date(), burnin_duration == None)
+        if fingerprint == self._last_fingerprint:
+            elapsed_row = self.get_elapsed_row(elapsed, burnin_duration).encode()
+            self._write(_CURSOR_UP_LINES % 1 + _CLEAR_LINE + elapsed_row + _NL)
+            return
+        self._last_fingerprint = fingerprint
+
         self._add_display_line(f'DB size: {self.stats.db_size()}')
-        if self.stats.columnstore_stats():
+        columnstore_stats = self.stats.columnstore_stats()
+        if columnstore_stats:
             self._add_display_line('')
-            self._add_display_line('Table size and S64 DA columnstore status')
-            self._add_display_line('|    table     | heap size |  colstore |  ratio  | cached |')
-            self._add_display_line('|---------------------------------------------------------|')
-            for row in self.stats.columnstore_stats():
+            for line in self._colstore_header_lines:
+                self._add_display_line(line)
+            for row in columnstore_stats:
                 self._add_display_line(self.get_columnstore_row(row))
         self._add_display_line('')
         self._add_display_line('OLTP workload status')
-        history_length = self.stats.get_history_length()
-        self._add_display_line('|     TYPE     |  ISSUED  |  COMPLETED | ERRORS |         TPS (last {}s)        |   LATENCY (last {}s, in ms)   |'.format(history_length, history_length))
-        self._add_display_line('|              |          |            |        |  LAST |  MIN  |  AVG  |  MAX  |  LAST |  MIN  |  AVG  |  MAX  |')
-        self._add_display_line('|---------------------------------------------------------------------------------------------------------------|')
+        self._add_display_line(self.get_oltp_header(self.stats.get_history_length()))
+        self._add_display_line(self._oltp_subheader)
+        self._add_display_line(self._oltp_separator)
         for query_type in QUERY_TYPES:
             self._add_display_line(self.get_oltp_row(query_type))
-        self._add_display_line('|---------------------------------------------------------------------------------------------------------------|')
+        self._add_display_line(self._oltp_separator)
         self._add_display_line(self.get_oltp_row())
 
         if self.num_olap_workers > 0:
+            self._snapshot_olap()
             self._add_display_line('')
             self._add_display_line('OLAP workload status')
-            olap_header = self.get_olap_header()
-            self._add_display_line(olap_header)
-            self._add_display_line('-' * len(olap_header))
+            self._add_display_line(self._olap_header)
+            self._add_display_line(self._olap_separator)
 
+            add_display_line = self._add_display_line
+            get_olap_row = self.get_olap_row
             for query_id in QUERY_IDS:
-                self._add_display_line(self.get_olap_row(query_id))
-            self._add_display_line('-' * len(olap_header))
+                add_display_line(get_olap_row(query_id))
+            self._add_display_line(self._olap_separator)
             self._add_display_line(self.get_olap_sum())
 
         self._add_display_line('')
         phase = 'burn-in (only OLTP workload)' if burnin_duration == None else 'HTAP (OLTP and OLAP workloads)'
         latest_time = latest_timestamp.date()
-        date_range = relativedelta(latest_time, self.min_timestamp)
-        data_warning = "(not enough for consistent OLAP queries)" if date_range.years < 7 else ""
-        self._add_display_line(f'Phase: {phase} | Data range: {self.min_timestamp} - {latest_time} = {date_range.years} years, {date_range.months} months and {date_range.days} days {data_warning}')
+        years, months, days = _date_range(self.min_timestamp, latest_time)
+        data_warning = "(not enough for consistent OLAP queries)" if latest_time - self.min_timestamp < WANTED_RANGE else ""
+        self._add_display_line(f'Phase: {phase} | Data range: {self.min_timestamp} - {latest_time} = {years} years, {months} months and {days} days {data_warning}')
 
-        htap_time = 0
-        if burnin_duration == None:
-            burnin_duration = elapsed
-        else:
-            htap_time = (elapsed - burnin_duration).total_seconds()
-        self._add_display_line(f'Time elapsed: {elapsed.total_seconds():.0f}s | Burn-in: {burnin_duration.total_seconds():.0f}s | HTAP: {htap_time:.0f}s')
+        self._add_display_line(self.get_elapsed_row(elapsed, burnin_duration))
         self._print()
@@ -15,7 +15,7 @@ from s64da_benchmark_toolkit.dbconn import DBConn
 LOG = logging.getLogger()
 register_uuid()
 
-QUERY_TYPES = ['new_order', 'payment', 'order_status', 'delivery', 'stock_level']
+QUERY_TYPES = ('new_order', 'payment', 'order_status', 'delivery', 'stock_level')
 
 class OLTPBucketStats:
     def __init__(self):
@@ -88,6 +88,8 @@ class Stats:
         self.uuid = uuid4()
         self.num_oltp_slots = num_oltp_slots
         self.updates = 0
+        # bumped on every change to the displayed data, so the monitor can skip unchanged refreshes
+        self.revision = 0
         self.csv_interval = csv_interval
         self.dsn = dsn
         self.database = urlparse(self.dsn).path[1:]
@@ -141,6 +143,7 @@ class Stats:
         self._write_olap_stream_stat(stat)
 
     def _process_queue(self, src, item):
+        self.revision += 1
         if src == 'oltp':
             self._update_oltp_stats(item)
         elif src == 'olap':
@@ -149,6 +152,7 @@ class Stats:
             self._update_olap_stream_stats(item)
 
     def _update_cached_stats(self):
+        self.revision += 1
         with self.conn as conn:
             try:
                 conn.cursor.execute("select DISTINCT table_name,relation_blocks,compressed_blocks,cache_pages_usable from swarm64da.stat_all_column_store_indexes")
@@ -273,7 +277,7 @@ class Stats:
             self.csv_olap_stream.flush()
 
     def _write_oltp_stats(self):
-        for query_type in QUERY_TYPES + [None]:
+        for query_type in QUERY_TYPES + (None,):
             counters = self.oltp_counts(query_type)
             tps, latency = self.oltp_total(query_type)
             name = 'All types' if query_type == None else query_type
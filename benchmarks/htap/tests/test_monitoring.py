@@ -0,0 +1,74 @@
+import pytest
+
+from datetime import date, datetime, timedelta
+
+from benchmarks.htap.lib.monitoring import Monitor, _date_range
+from benchmarks.htap.lib.stats import Stats
+
+
+def make_stats(num_olap_slots, items=()):
+    stats = Stats('empty', num_oltp_slots=1, num_olap_slots=num_olap_slots, csv_interval=None)
+    for src, item in items:
+        stats._process_queue(src, item)
+    return stats
+
+
+def test_print_redraws_previous_frame(capsys):
+    fixture = Monitor(None, 1, 0, 10, datetime(2020, 1, 1))
+
+    fixture._add_display_line('first')
+    fixture._add_display_line('second')
+    fixture._print()
+    assert capsys.readouterr().out == 'first\nsecond\n'
+    assert fixture.total_lines == 2
+    assert fixture._buf == b''
+
+    fixture._add_display_line('third')
+    fixture._print()
+    assert capsys.readouterr().out == '\033[2F\033[Jthird\n'
+    assert fixture.total_lines == 1
+
+
+def test_olap_rows_from_snapshot():
+    stats = make_stats(2, [
+        ('olap', {'stream': 0, 'query': 1, 'status': 'Ok', 'runtime': 1.5, 'iteration': 1,
+                  'planned_rows': 12000, 'processed_rows': 3000}),
+        ('olap', {'stream': 1, 'query': 1, 'status': 'Running'}),
+        ('olap', {'stream': 1, 'query': 2, 'status': 'Timeout', 'runtime': 2.25, 'iteration': 1,
+                  'planned_rows': 0, 'processed_rows': 0}),
+    ])
+    fixture = Monitor(stats, 1, 2, 10, datetime(2020, 1, 1))
+    fixture._snapshot_olap()
+
+    assert fixture.get_olap_row(1) == 'Query  1 |   1.50 OK |  Running  |           12K |             3K |'
+    assert fixture.get_olap_row(2) == 'Query  2 |  Waiting  |   2.25 TIM|            0K |             0K |'
+    assert fixture.get_olap_sum() == 'Total    |      1.50 |      2.25 |'
+
+
+def test_update_display_only_redraws_elapsed_time_without_new_stats(capsys):
+    stats = make_stats(1)
+    stats.cached_database_size = 0
+    stats.cached_columnstore_stats = []
+    fixture = Monitor(stats, 1, 1, 10, datetime(2020, 1, 1))
+
+    fixture.update_display(timedelta(seconds=1), None, None, None, datetime(2027, 1, 1))
+    full_frame = capsys.readouterr().out
+    assert full_frame.endswith('\nTime elapsed: 1s | Burn-in: 1s | HTAP: 0s\n')
+
+    fixture.update_display(timedelta(seconds=2), None, None, None, datetime(2027, 1, 1))
+    assert capsys.readouterr().out == '\033[1F\033[2KTime elapsed: 2s | Burn-in: 2s | HTAP: 0s\n'
+
+    stats._process_queue('olap', {'stream': 0, 'query': 1, 'status': 'Running'})
+    fixture.update_display(timedelta(seconds=3), None, None, None, datetime(2027, 1, 1))
+    frame = capsys.readouterr().out
+    num_lines = full_frame.count('\n')
+    assert frame.startswith(f'\033[{num_lines}F\033[J')
+    assert 'Query  1 |  Running  |' in frame
+
+
+def test_date_range():
+    assert _date_range(date(1992, 1, 1), date(1998, 12, 31)) == (6, 11, 30)
+    assert _date_range(date(1992, 1, 1), date(1999, 1, 1)) == (7, 0, 0)
+    assert _date_range(date(2002, 1, 31), date(2008, 6, 30)) == (6, 5, 0)
+    assert _date_range(date(2002, 1, 31), date(2002, 3, 30)) == (0, 1, 30)
+    assert _date_range(date(2020, 2, 29), date(2021, 2, 28)) == (1, 0, 0)
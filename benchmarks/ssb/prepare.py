@@ -10,6 +10,12 @@ class PrepareBenchmark(PrepareBenchmarkFactory):
         'lineorder'
     ),)
 
+    PrepareBenchmarkFactory.TABLE_WEIGHTS = {
+        'lineorder': 594,
+        'part': 17,
+        'customer': 3
+    }
+
     def get_ingest_tasks(self, table):
         use_chunks = (self.args.scale_factor > 1 and
                       self.args.chunks > 1 and
@@ -17,14 +23,14 @@ class PrepareBenchmark(PrepareBenchmarkFactory):
         table_code = table[0]
 
         dbgen_cmd = f'./dbgen -s {self.args.scale_factor} -T {table_code} -O o'
-        psql_copy = self.psql_exec_cmd(f"COPY {table} FROM STDIN WITH DELIMITER '|'")
+        copy_sql = f"COPY {table} FROM STDIN WITH DELIMITER '|'"
         sed_cmd = "sed 's/|$//'"
 
         if use_chunks:
-            tasks = [f'{dbgen_cmd} -S {chunk} -C {self.args.chunks} | {sed_cmd} | {psql_copy}' for
+            tasks = [self.copy_from_cmd(f'{dbgen_cmd} -S {chunk} -C {self.args.chunks} | {sed_cmd}', copy_sql) for
                      chunk in range(1, self.args.chunks + 1)]
 
         else:
-            tasks = [f"{dbgen_cmd} | {sed_cmd} | {psql_copy}"]
+            tasks = [self.copy_from_cmd(f"{dbgen_cmd} | {sed_cmd}", copy_sql)]
 
         return tasks
@@ -43,6 +43,23 @@ class PrepareBenchmark(PrepareBenchmarkFactory):
         }
     }
 
+    PrepareBenchmarkFactory.TABLE_WEIGHTS = {
+        'store_sales': 379,
+        'catalog_sales': 283,
+        'inventory': 227,
+        'web_sales': 141,
+        'customer_demographics': 77,
+        'store_returns': 33,
+        'catalog_returns': 21,
+        'customer': 13,
+        'date_dim': 10,
+        'web_returns': 10,
+        'customer_address': 5,
+        'item': 5,
+        'time_dim': 5,
+        'catalog_page': 2
+    }
+
     PrepareBenchmarkFactory.CLUSTER_SPEC = {
         'time_dim': 't_time_sk',
         'item': 'i_current_price',
@@ -55,12 +72,12 @@ class PrepareBenchmark(PrepareBenchmarkFactory):
                 f"WITH (FORMAT CSV, DELIMITER '|')\"")
 
     def get_copy_cmds(self, data_dir, table):
-        copy_cmd = self.psql_exec_cmd(f'COPY {table} FROM STDIN WITH (FORMAT CSV, DELIMITER \'|\')')
+        copy_sql = f'COPY {table} FROM STDIN WITH (FORMAT CSV, DELIMITER \'|\')'
         full_path = os.path.join(data_dir, f'{table}.*gz')
         data_files = glob(full_path)
         if not data_files:
             raise FileNotFoundError(f'{full_path} does not exist xor cannot be expanded')
-        return [f'gunzip -c {data_file} | {copy_cmd}' for data_file in data_files]
+        return [self.copy_from_cmd(f'gunzip -c {data_file}', copy_sql) for data_file in data_files]
 
     def _ingest_task_impl(self, table, dbgen):
         task = f'{dbgen} | recode ISO-8859-1..UTF-8 | '
@@ -32,6 +32,15 @@ class PrepareBenchmark(PrepareBenchmarkFactory):
         }
     }
 
+    PrepareBenchmarkFactory.TABLE_WEIGHTS = {
+        'lineitem': 725,
+        'orders': 164,
+        'partsupp': 113,
+        'part': 23,
+        'customer': 23,
+        'supplier': 1
+    }
+
     PrepareBenchmarkFactory.CLUSTER_SPEC = {
         'lineitem': 'l_shipdate,l_receiptdate',
         'orders': 'o_orderdate'
@@ -49,12 +58,12 @@ class PrepareBenchmark(PrepareBenchmarkFactory):
     }
 
     def get_copy_cmds(self, data_dir, table):
-        copy_cmd = self.psql_exec_cmd(f'COPY {table} FROM STDIN WITH (FORMAT CSV, DELIMITER \'|\')')
+        copy_sql = f'COPY {table} FROM STDIN WITH (FORMAT CSV, DELIMITER \'|\')'
         full_path = os.path.join(data_dir, f'{table}.*gz')
         data_files = glob(full_path)
         if not data_files:
             raise FileNotFoundError(f'{full_path} does not exist xor cannot be expanded')
-        return [f'gunzip -c {data_file} | {copy_cmd}' for data_file in data_files]
+        return [self.copy_from_cmd(f'gunzip -c {data_file}', copy_sql) for data_file in data_files]
 
     def get_ingest_tasks(self, table):
         if self.args.data_dir:
@@ -65,10 +74,10 @@ class PrepareBenchmark(PrepareBenchmarkFactory):
         table_code = PrepareBenchmark.TABLE_CODES[table]
 
         dbgen_cmd = f'./dbgen -s {self.args.scale_factor} -T {table_code} -o'
-        psql_copy = self.psql_exec_cmd(f"COPY {table} FROM STDIN WITH DELIMITER '|'")
+        copy_sql = f"COPY {table} FROM STDIN WITH DELIMITER '|'"
 
         if use_chunks:
-            return [f'{dbgen_cmd} -S {chunk} -C {self.args.chunks} | {psql_copy}' for
+            return [self.copy_from_cmd(f'{dbgen_cmd} -S {chunk} -C {self.args.chunks}', copy_sql) for
                     chunk in range(1, self.args.chunks + 1)]
 
-        return [f'{dbgen_cmd} | {psql_copy}']
+        return [self.copy_from_cmd(dbgen_cmd, copy_sql)]
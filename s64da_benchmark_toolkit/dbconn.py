@@ -1,7 +1,11 @@
 
 import logging
+import queue
+import threading
 import time
 
+from contextlib import contextmanager
+
 import psycopg2
 from psycopg2.extras import DictCursor
 
@@ -44,3 +48,67 @@ class DBConn:
     def __exit__(self, *args):
         self.cursor.close()
         self.conn.close()
+
+
+class DBConnPool:
+    """
+    Up to size connections to the same DSN which are kept open to be reused.
+    Connections are only opened when there is no idle one to hand out.
+    """
+    def __init__(self, dsn, size):
+        self.dsn = dsn
+        self.size = size
+        self._idle = queue.Queue()
+        self._available = threading.BoundedSemaphore(size)
+        self._busy = set()
+        # reentrant, a signal handler may cancel while the main thread holds it
+        self._busy_lock = threading.RLock()
+
+    def _get_idle(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+
+            # skip connections that have been closed while they were idle
+            if not conn.conn.closed:
+                return conn
+            conn.__exit__()
+
+    def checkout(self):
+        self._available.acquire()
+        try:
+            conn = self._get_idle() or DBConn(self.dsn).__enter__()
+        except BaseException:
+            self._available.release()
+            raise
+
+        with self._busy_lock:
+            self._busy.add(conn)
+        return conn
+
+    def checkin(self, conn):
+        with self._busy_lock:
+            self._busy.discard(conn)
+        self._idle.put(conn)
+        self._available.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.checkout()
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    def cancel(self):
+        # stop the statements running on the connections that are checked out
+        with self._busy_lock:
+            for conn in self._busy:
+                conn.conn.cancel()
+
+    def close(self):
+        # only the idle connections, the pool stays usable and reopens them on demand
+        while not self._idle.empty():
+            self._idle.get_nowait().__exit__()
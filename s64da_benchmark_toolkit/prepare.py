@@ -2,11 +2,12 @@
 import glob
 import os
 import re
-import shutil
+import signal
 import threading
 import time
 import random
 
+from collections import defaultdict
 from sys import exit
 from traceback import print_tb
 
@@ -15,13 +16,14 @@ from jinja2 import Environment, FileSystemLoader
 from packaging.version import Version
 from pathlib import Path
 from psycopg2 import ProgrammingError, errors
-from sqlparse import split as sqlparse_split
+from sqlparse import format as sqlparse_format, split as sqlparse_split
 from subprocess import Popen, PIPE
 from urllib.parse import urlparse
 
-from .dbconn import DBConn
+from .dbconn import DBConn, DBConnPool
 
 s64_benchmark_toolkit_root_dir = Path(os.path.abspath(__file__)).parents[1]
+COPY_BUFFER_SIZE = 1 << 20
 
 class NoIngestException(Exception):
     """Exception when no rows have been inserted into the table."""
@@ -46,6 +48,8 @@ class PrepareBenchmarkFactory:
     TABLES = []
     TABLES_ANALYZE = None
     SIZING_FACTORS = {}
+    # relative ingest cost of the tables, e.g. their data size in MB at scale factor 1
+    TABLE_WEIGHTS = {}
     CLUSTER_SPEC = {}
     PYTHON_LOADER = False
     DO_SHUFFLE = True
@@ -57,6 +61,13 @@ class PrepareBenchmarkFactory:
         self.schema_dir = os.path.join(schemas_dir, args.schema)
         self.data_dir = args.data_dir
         self.cancel_event = threading.Event()
+        # shell commands that are currently running, so that an abort can stop them.
+        # Reentrant because the signal handler may interrupt a holder in the main thread.
+        self._processes = set()
+        self._processes_lock = threading.RLock()
+        # shared by all phases, so connections are reused instead of reopened
+        self.conn_pool = DBConnPool(args.dsn, args.max_jobs)
+        self._data_file_sizes = {}
         self.num_partitions = args.num_partitions
         assert os.path.isdir(self.schema_dir), \
             f'Schema does not exist. Available ones are subfolders in {schemas_dir}'
@@ -64,7 +75,7 @@ class PrepareBenchmarkFactory:
     @property
     def swarm64da_version(self):
         try:
-            with DBConn(self.args.dsn) as conn:
+            with self.conn_pool.connection() as conn:
                 conn.cursor.execute('SELECT swarm64da.get_version()')
                 result = conn.cursor.fetchone()[0]
 
@@ -81,6 +92,17 @@ class PrepareBenchmarkFactory:
     def psql_exec_cmd(self, sql):
         return f'psql {self.args.dsn} -c "{sql}"'
 
+    def copy_from_cmd(self, cmd, copy_sql):
+        return (self._copy_from_cmd, cmd, copy_sql)
+
+    def pooled_exec_cmd(self, sql):
+        return (self._pooled_exec_cmd, sql)
+
+    @staticmethod
+    def _split_sql(sql):
+        # every statement gets its own psql process, so skip fragments that hold only comments
+        return [stmt for stmt in sqlparse_split(sql) if sqlparse_format(stmt, strip_comments=True).strip()]
+
     @staticmethod
     def check_ingest(output):
         if output is not None and output.startswith("COPY"):
@@ -89,21 +111,101 @@ class PrepareBenchmarkFactory:
                 raise NoIngestException("Ingest failed.")
 
 
-    def _run_shell_task(self, task, return_output=False):
-        if not self.cancel_event.is_set():
-            p = Popen(task, cwd=self.benchmark.base_dir, shell=True, executable='/bin/bash',
-                      stdout=PIPE if return_output else None)
+    def _start_process(self, cmd, stdout=None):
+        # every command gets its own process group, so a kill also stops all parts of a pipeline.
+        # Starting under the lock means no command can slip past an abort's sweep.
+        with self._processes_lock:
+            if self.cancel_event.is_set():
+                return None
+
+            p = Popen(cmd, cwd=self.benchmark.base_dir, shell=True, executable='/bin/bash',
+                      stdout=stdout, start_new_session=True)
+            self._processes.add(p)
+            return p
+
+    def _wait_process(self, p):
+        try:
             p.wait()
-            if p.returncode != 0:
-                self.cancel_event.set()
-                exit(task)
+        except BaseException:
+            self._kill_process(p)
+            raise
+        finally:
+            with self._processes_lock:
+                self._processes.discard(p)
 
-            if return_output:
-                stdout, _ = p.communicate()
-                print(stdout.decode('utf-8'), end='')
-                return stdout.decode('utf-8')
+    @staticmethod
+    def _kill_process(p):
+        if p.poll() is None:
+            try:
+                os.killpg(p.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def _abort(self):
+        # cancel and sweep under the lock, so no shell command can start afterwards.
+        # The pooled statements are no processes, the server has to cancel them.
+        with self._processes_lock:
+            self.cancel_event.set()
+            for p in self._processes:
+                self._kill_process(p)
+        self.conn_pool.cancel()
+
+    def _abort_on_signal(self, signum, frame):
+        # the shell commands run in sessions of their own, so a SIGTERM or SIGHUP
+        # for our process group does not reach them and they have to be killed here
+        self._abort()
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+    def _run_shell_task(self, task, return_output=False):
+        p = self._start_process(task, stdout=PIPE if return_output else None)
+        if p is None:
+            return None
+
+        self._wait_process(p)
+        if p.returncode != 0:
+            self.cancel_event.set()
+            exit(task)
+
+        if return_output:
+            stdout, _ = p.communicate()
+            print(stdout.decode('utf-8'), end='')
+            return stdout.decode('utf-8')
+
+    def _pooled_exec_cmd(self, sql):
+        if not self.cancel_event.is_set():
+            with self.conn_pool.connection() as conn:
+                conn.cursor.execute(sql)
+
+    def _copy_from_cmd(self, cmd, copy_sql):
+        # only the data generator runs as a shell command, its output is streamed
+        # into a pooled connection rather than into a psql process of its own.
+        # pipefail makes a failing generator fail the task even if it is piped
+        # through a filter.
+        p = self._start_process(f'set -o pipefail; {cmd}', stdout=PIPE)
+        if p is None:
+            return None
 
-    def _run_tasks_parallel(self, tasks, executor_class=ThreadPoolExecutor):
+        try:
+            with self.conn_pool.connection() as conn:
+                # read in large chunks, every read holds the GIL that all loader threads share
+                conn.cursor.copy_expert(copy_sql, p.stdout, size=COPY_BUFFER_SIZE)
+                output = f'COPY {conn.cursor.rowcount}'
+        except BaseException:
+            self._kill_process(p)
+            raise
+        finally:
+            p.stdout.close()
+            self._wait_process(p)
+
+        if p.returncode != 0:
+            self.cancel_event.set()
+            exit(cmd)
+
+        print(output)
+        return output
+
+    def _run_tasks_parallel(self, tasks, executor_class=ThreadPoolExecutor, weights=None):
         def get_runnable_task(task):
             if isinstance(task, tuple):
                 task, task_args = (task[0], task[1:])
@@ -126,8 +228,16 @@ class PrepareBenchmarkFactory:
             return True
 
         # randomize the tasks to decrease lock contention
+        order = list(range(len(tasks)))
         if PrepareBenchmarkFactory.DO_SHUFFLE:
-            random.shuffle(tasks)
+            random.shuffle(order)
+
+        # start the most expensive tasks first so that the cheap ones fill up the tail
+        # instead of a big one starting last. The sort is stable, so tasks of the
+        # same weight stay shuffled.
+        if weights:
+            order.sort(key=lambda idx: weights[idx], reverse=True)
+        tasks = [tasks[idx] for idx in order]
 
         # If we're asked to use only with one job, run the tasks directly
         # in the main process to ease profiling.
@@ -139,19 +249,35 @@ class PrepareBenchmarkFactory:
                     print('Ingest failed!')
                     exit(1)
         else:
-            with executor_class(max_workers=self.args.max_jobs) as executor:
-                futures = [get_future(task) for task in tasks]
+            executor_kwargs = {}
+            if issubclass(executor_class, ThreadPoolExecutor):
+                executor_kwargs['thread_name_prefix'] = 'prepare'
+
+            executor = executor_class(max_workers=self.args.max_jobs, **executor_kwargs)
+            futures = [get_future(task) for task in tasks]
+            try:
                 for completed_future in as_completed(futures):
-                    ingest_failed = not ingest_succeeded(completed_future.result())
                     exc = completed_future.exception()
                     if exc:
                         print(f'Task threw an exception: {exc}')
                         print_tb(exc.__traceback__)
-                    if exc or ingest_failed:
-                            for future in futures:
-                                future.cancel()
-                            print('Ingest failed!')
-                            exit(1)
+                    if exc or not ingest_succeeded(completed_future.result()):
+                        print('Ingest failed!')
+                        exit(1)
+            except BaseException:
+                # Abort right away instead of waiting for the remaining tasks: queued
+                # tasks turn into no-ops once the event is set and the running shell
+                # commands and loader processes get killed, otherwise the interpreter
+                # would still wait for them on exit.
+                for future in futures:
+                    future.cancel()
+                self._abort()
+                for process in (getattr(executor, '_processes', None) or {}).values():
+                    process.terminate()
+                executor.shutdown(wait=False)
+                raise
+
+            executor.shutdown()
 
     def _check_diskspace(self, diskpace_check_dir):
         db_type = os.path.basename(self.schema_dir).split('_')[0]
@@ -171,50 +297,68 @@ class PrepareBenchmarkFactory:
               f'    Scale factor  : {scale_factor}\n'
               f'    Size factor   : {size_factor}')
 
-        _, _, free = shutil.disk_usage(diskpace_check_dir)
+        # do not assert, the check must not vanish when running with python -O
+        stat = os.statvfs(diskpace_check_dir)
+        free = stat.f_bavail * stat.f_frsize
         space_needed = int(scale_factor * size_factor) << 30
-        assert space_needed < free, \
-            f'Not enough disk space available. Needed [GBytes]: {space_needed>>30}, free: {free>>30}'
+        if space_needed >= free:
+            raise RuntimeError(
+                f'Not enough disk space available. Needed [GBytes]: {space_needed>>30}, free: {free>>30}')
 
     def run(self):
+        for signum in (signal.SIGTERM, signal.SIGHUP):
+            signal.signal(signum, self._abort_on_signal)
+
         diskpace_check_dir = self.args.check_diskspace_of_directory
         if diskpace_check_dir:
             self._check_diskspace(diskpace_check_dir)
 
-        print('Preparing DB')
-        self.prepare_db()
-
-        print('Ingesting data')
-        self.cancel_event.clear()
-        start_ingest = time.time()
-        for table_group in PrepareBenchmarkFactory.TABLES:
-            ingest_tasks = []
-            for table in table_group:
-                tasks = self.get_ingest_tasks(table)
-                assert isinstance(tasks, list), 'Returned object is not a list'
-                ingest_tasks.extend(tasks)
-
-            if PrepareBenchmarkFactory.PYTHON_LOADER:
-                self._run_tasks_parallel(ingest_tasks, executor_class=ProcessPoolExecutor)
-            else:
-                self._run_tasks_parallel(ingest_tasks)
-
-        ingest_duration = time.time() - start_ingest
-
-        print('Adding indices')
-        start_optimize = time.time()
-        self.add_indexes()
-
-        print('Adding common')
-        self.add_common()
-
-        print('Updating all columnstore indexes')
-        self.update_all_columnstores()
-
-        print('VACUUM-ANALYZE')
-        self.vacuum_analyze()
-
-        optimize_duration = time.time() - start_optimize
+        try:
+            print('Preparing DB')
+            self.prepare_db()
+
+            print('Ingesting data')
+            self.cancel_event.clear()
+            if self.data_dir:
+                self._data_file_sizes = self._scan_data_file_sizes()
+            start_ingest = time.time()
+            for table_group in PrepareBenchmarkFactory.TABLES:
+                ingest_tasks = []
+                ingest_weights = []
+                for table in table_group:
+                    tasks = self.get_ingest_tasks(table)
+                    assert isinstance(tasks, list), 'Returned object is not a list'
+                    ingest_tasks.extend(tasks)
+                    ingest_weights.extend([self.get_table_weight(table) / max(1, len(tasks))] * len(tasks))
+
+                if PrepareBenchmarkFactory.PYTHON_LOADER:
+                    self._run_tasks_parallel(ingest_tasks, executor_class=ProcessPoolExecutor,
+                                             weights=ingest_weights)
+                else:
+                    self._run_tasks_parallel(ingest_tasks, weights=ingest_weights)
+
+            ingest_duration = time.time() - start_ingest
+
+            print('Adding indices')
+            start_optimize = time.time()
+            self.add_indexes()
+
+            print('Adding common')
+            self.add_common()
+
+            # the pooled connections sat idle through the index builds, which can take hours
+            # and get them dropped by the server or the network, so start with fresh ones
+            self.conn_pool.close()
+
+            print('Updating all columnstore indexes')
+            self.update_all_columnstores()
+
+            print('VACUUM-ANALYZE')
+            self.vacuum_analyze()
+
+            optimize_duration = time.time() - start_optimize
+        finally:
+            self.conn_pool.close()
 
         with open("prepare_metrics.csv", "w") as prepare_metrics_file:
             prepare_metrics_file.write(f'ingest; {ingest_duration}\n')
@@ -223,19 +367,20 @@ class PrepareBenchmarkFactory:
 
         print(f'Process complete. DSN: {self.args.dsn}')
 
-    def _load_pre_schema(self, conn):
+    def _load_sql_file(self, sql_file_path):
+        # let psql stream the file instead of reading it into memory, and make it
+        # stop at the first error like a failing execute() would have
+        self._run_shell_task(f'{self.psql_exec_file(sql_file_path)} -q -v ON_ERROR_STOP=1')
+
+    def _load_pre_schema(self):
         pre_schema_path = os.path.join(self.schema_dir, 'pre_schema.sql')
         if os.path.isfile(pre_schema_path):
             print(f'Loading pre-schema {pre_schema_path}')
-            with open(pre_schema_path, 'r') as pre_schema_file:
-                conn.cursor.execute(pre_schema_file.read())
+            self._load_sql_file(pre_schema_path)
 
-    
-    def _load_schema(self, conn, applied_schema_path):
+    def _load_schema(self, applied_schema_path):
         print(f'Loading schema {applied_schema_path}')
-        with open(applied_schema_path, 'r') as schema:
-            schema_sql = schema.read()
-            conn.cursor.execute(schema_sql)
+        self._load_sql_file(applied_schema_path)
 
     def prepare_db(self):
         dsn_url = urlparse(self.args.dsn)
@@ -256,19 +401,77 @@ class PrepareBenchmarkFactory:
         with open(applied_schema_path, "w") as applied_schema_file:
             applied_schema_file.write(applied_schema)
 
-        with DBConn(self.args.dsn) as conn:
-            print('Adding helper functions.')
-            common_file_path = os.path.join(s64_benchmark_toolkit_root_dir, 'benchmarks', 'common', 'functions.sql')
-            with open(common_file_path, 'r') as common_sql:
-                conn.cursor.execute(common_sql.read())
+        print('Adding helper functions.')
+        common_file_path = os.path.join(s64_benchmark_toolkit_root_dir, 'benchmarks', 'common', 'functions.sql')
+        self._load_sql_file(common_file_path)
 
-            self._load_pre_schema(conn)
-            self._load_schema(conn, applied_schema_path)
+        self._load_pre_schema()
+        self._load_schema(applied_schema_path)
 
     def get_ingest_tasks(self, table):
         return []
 
+    def _scan_data_file_sizes(self):
+        # data files are named <table>.<suffix>, one directory scan sizes all of them
+        sizes = defaultdict(int)
+        if not os.path.isdir(self.data_dir):
+            # leave it to the loaders to report the missing data
+            return sizes
+
+        with os.scandir(self.data_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    sizes[entry.name.split('.', 1)[0]] += entry.stat().st_size
+        return sizes
+
+    def get_table_weight(self, table):
+        # the size of the files to ingest beats the estimate
+        if self._data_file_sizes:
+            return self._data_file_sizes.get(table, 0)
+        return PrepareBenchmarkFactory.TABLE_WEIGHTS.get(table, 0)
+
+    def _current_index_build_settings(self):
+        # maintenance_work_mem in kB, the worker setting is missing before PostgreSQL 11
+        with self.conn_pool.connection() as conn:
+            conn.cursor.execute(
+                "SELECT name, setting::bigint FROM pg_settings "
+                "WHERE name IN ('maintenance_work_mem', 'max_parallel_maintenance_workers')")
+            return dict(conn.cursor.fetchall())
+
+    def _index_build_options(self):
+        maintenance_work_mem = self.args.maintenance_work_mem
+        max_parallel_maintenance_workers = self.args.max_parallel_maintenance_workers
+
+        # Up to max_jobs indexes are built at the same time, so they share the machine.
+        # The defaults only ever raise the server's settings, never below PostgreSQL's own.
+        if not maintenance_work_mem or max_parallel_maintenance_workers is None:
+            max_jobs = self.args.max_jobs
+            current = self._current_index_build_settings()
+
+            if not maintenance_work_mem:
+                total_memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+                memory_share = max(64, (total_memory >> 20) // (8 * max_jobs))
+                if memory_share > current['maintenance_work_mem'] >> 10:
+                    maintenance_work_mem = f'{memory_share}MB'
+
+            if max_parallel_maintenance_workers is None and 'max_parallel_maintenance_workers' in current:
+                workers_share = max(2, os.cpu_count() // max_jobs)
+                if workers_share > current['max_parallel_maintenance_workers']:
+                    max_parallel_maintenance_workers = workers_share
+
+        options = []
+        if maintenance_work_mem:
+            options.append(f'-c maintenance_work_mem={maintenance_work_mem}')
+        if max_parallel_maintenance_workers is not None:
+            options.append(f'-c max_parallel_maintenance_workers={max_parallel_maintenance_workers}')
+        return ' '.join(options)
+
     def add_indexes(self):
+        pg_options = self._index_build_options()
+        if pg_options:
+            print(f'Building indexes with {pg_options}')
+            pg_options = f"PGOPTIONS='{pg_options}' "
+
         for sql_file in ('primary-keys.sql', 'foreign-keys.sql', 'indexes.sql', 's64da_indexes.sql'):
             sql_file_path = os.path.join(s64_benchmark_toolkit_root_dir, self.schema_dir, sql_file)
             if not os.path.isfile(sql_file_path):
@@ -278,7 +481,7 @@ class PrepareBenchmarkFactory:
             with open(sql_file_path, 'r') as sql_file:
                 sql = sql_file.read()
 
-            tasks = [self.psql_exec_cmd(cmd) for cmd in sqlparse_split(sql)]
+            tasks = [f'{pg_options}{self.psql_exec_cmd(cmd)}' for cmd in self._split_sql(sql)]
             self._run_tasks_parallel(tasks)
 
     def add_common(self):
@@ -294,8 +497,8 @@ class PrepareBenchmarkFactory:
         tables = PrepareBenchmarkFactory.TABLES_ANALYZE or PrepareBenchmarkFactory.TABLES
         for table_group in tables:
             for table in table_group:
-                vacuum_tasks.append(self.psql_exec_cmd(f'VACUUM {table}'))
-                analyze_tasks.append(self.psql_exec_cmd(f'ANALYZE {table}'))
+                vacuum_tasks.append(self.pooled_exec_cmd(f'VACUUM {table}'))
+                analyze_tasks.append(self.pooled_exec_cmd(f'ANALYZE {table}'))
 
         # WARNING: do NOT run vacuum and analyze at the same time because analyze stops as soon as it cannot take the lock...
         self._run_tasks_parallel(vacuum_tasks)
@@ -306,5 +509,5 @@ class PrepareBenchmarkFactory:
         version = self.swarm64da_version
         if version and version >= Version('5.5'):
             print('Fully updating all columnstores')
-            tasks = [self.psql_exec_cmd('SELECT swarm64da.columnstore_update_full()')]
+            tasks = [self.pooled_exec_cmd('SELECT swarm64da.columnstore_update_full()')]
             self._run_tasks_parallel(tasks)
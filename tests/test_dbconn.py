@@ -41,3 +41,58 @@ def test_dbconn_connect_fail(nosleep, mocker):
             pass
 
     assert psycopg2_connect.call_count == num_retries
+
+
+def test_dbconn_pool_reuses_connections(nosleep, mocker):
+    psycopg2_connect = mocker.patch('psycopg2.connect')
+    psycopg2_connect.return_value.closed = 0
+
+    pool = dbconn.DBConnPool(DSN, 2)
+    with pool.connection() as conn:
+        with pool.connection() as other_conn:
+            assert conn is not other_conn
+    with pool.connection() as conn:
+        pass
+
+    assert psycopg2_connect.call_count == 2
+
+    pool.close()
+    assert psycopg2_connect.return_value.close.call_count == 2
+
+
+def test_dbconn_pool_is_bounded(nosleep, mocker):
+    mocker.patch('psycopg2.connect').return_value.closed = 0
+
+    pool = dbconn.DBConnPool(DSN, 1)
+    conn = pool.checkout()
+    assert not pool._available.acquire(blocking=False)
+
+    pool.checkin(conn)
+    assert pool.checkout() is conn
+
+
+def test_dbconn_pool_replaces_closed_connections(nosleep, mocker):
+    psycopg2_connect = mocker.patch('psycopg2.connect', side_effect=lambda *args, **kwargs: mocker.Mock(closed=0))
+
+    pool = dbconn.DBConnPool(DSN, 1)
+    with pool.connection() as conn:
+        pass
+    conn.conn.closed = 2
+
+    with pool.connection() as other_conn:
+        assert other_conn is not conn
+    conn.conn.close.assert_called_once()
+    assert psycopg2_connect.call_count == 2
+
+
+def test_dbconn_pool_cancels_checked_out_connections(nosleep, mocker):
+    mocker.patch('psycopg2.connect', side_effect=lambda *args, **kwargs: mocker.Mock(closed=0))
+
+    pool = dbconn.DBConnPool(DSN, 2)
+    busy_conn = pool.checkout()
+    idle_conn = pool.checkout()
+    pool.checkin(idle_conn)
+
+    pool.cancel()
+    busy_conn.conn.cancel.assert_called_once()
+    idle_conn.conn.cancel.assert_not_called()
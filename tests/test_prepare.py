@@ -1,6 +1,13 @@
+import multiprocessing
+import signal
+import threading
+import time
+
 import pytest
 
-from s64da_benchmark_toolkit.prepare import PrepareBenchmarkFactory
+from concurrent.futures import ProcessPoolExecutor
+
+from s64da_benchmark_toolkit.prepare import PrepareBenchmarkFactory, TableGroup
 from s64da_benchmark_toolkit.streams import Benchmark
 from benchmarks.tpch import prepare as prepare_tpch
 from benchmarks.tpcds import prepare as prepare_tpcds
@@ -12,6 +19,7 @@ class ArgsMock:
     scale_factor = 100
     data_dir = '/some/fancy/dir'
     num_partitions = None
+    max_jobs = 8
 
 
 @pytest.fixture()
@@ -27,32 +35,31 @@ def prepare_mock(mocker):
     return PrepareTestBenchmark(ArgsMock(), Benchmark('foobar', '/bla/bleh/foobar'))
 
 
+def statvfs_mock(mocker, free):
+    return mocker.patch('os.statvfs', return_value=mocker.Mock(f_bavail=free // 4096, f_frsize=4096))
+
+
 def test_check_diskspace_ok(mocker, prepare_mock):
-    mocker.patch('shutil.disk_usage',
-                 return_value=(150 << 30, 50 << 30, 100 << 30),
-                 autospec=True)
+    statvfs = statvfs_mock(mocker, 100 << 30)
 
-    # Must not raise an AssertionError
+    # Must not raise a RuntimeError
     prepare_mock._check_diskspace('/xyz')
+    statvfs.assert_called_once_with('/xyz')
 
 
 def test_check_diskspace_not_ok(mocker, prepare_mock):
-    mocker.patch('shutil.disk_usage',
-                 return_value=(150 << 30, 100 << 30, 50 << 30),
-                 autospec=True)
+    statvfs_mock(mocker, 50 << 30)
 
-    with pytest.raises(AssertionError):
+    with pytest.raises(RuntimeError):
         prepare_mock._check_diskspace('/xyz')
 
 
 def test_check_diskspace_scale_factor_off(mocker, prepare_mock):
-    mocker.patch('shutil.disk_usage',
-                 return_value=(150 * 1024 * 1024, 100 * 1024 * 1024, 50 * 1024 * 1024),
-                 autospec=True)
+    statvfs_mock(mocker, 50 * 1024 * 1024)
 
     prepare_mock.args.scale_factor = 123
 
-    # Must not raise an AssertionError
+    # Must not raise a RuntimeError
     prepare_mock._check_diskspace('/xyz')
 
 
@@ -78,3 +85,289 @@ def test_get_copy_cmds_raises_filenotfound_err(mocker, prepare_mod, glob_returns
     )
     with pytest.raises(FileNotFoundError):
         bm.get_copy_cmds(args.data_dir, 'table')
+
+
+def test_split_sql_skips_comment_only_statements():
+    sql = ('CREATE INDEX a_idx ON a (x);\n'
+           '-- a disabled index\n'
+           'CREATE INDEX b_idx ON b (\n  y\n);\n'
+           '-- CREATE INDEX c_idx ON c (z);\n')
+
+    assert PrepareBenchmarkFactory._split_sql(sql) == [
+        'CREATE INDEX a_idx ON a (x);',
+        '-- a disabled index\nCREATE INDEX b_idx ON b (\n  y\n);'
+    ]
+
+
+def test_run_tasks_parallel_aborts_on_first_failure(mocker, tmp_path, prepare_mock):
+    prepare_mock.benchmark = Benchmark('foobar', str(tmp_path))
+    prepare_mock.args.max_jobs = 2
+    started = threading.Event()
+    processes = []
+
+    def start_process(*args, **kwargs):
+        processes.append(start_process.original(*args, **kwargs))
+        started.set()
+        return processes[-1]
+
+    start_process.original = prepare_mock._start_process
+    mocker.patch.object(prepare_mock, '_start_process', side_effect=start_process)
+
+    def failing_task(_):
+        started.wait(10)
+        raise RuntimeError('boom')
+
+    def later_task(_):
+        pass
+
+    tasks = ['sleep 10 | cat', (failing_task, None)] + [(later_task, None)] * 100
+    with pytest.raises(SystemExit):
+        prepare_mock._run_tasks_parallel(tasks)
+    assert prepare_mock.cancel_event.is_set()
+
+    # The in-flight shell task must have been killed instead of running to completion
+    assert len(processes) == 1
+    assert processes[0].wait(5) == -signal.SIGKILL
+
+
+def test_no_shell_task_starts_after_abort(mocker, tmp_path, prepare_mock):
+    prepare_mock.benchmark = Benchmark('foobar', str(tmp_path))
+    popen = mocker.patch('s64da_benchmark_toolkit.prepare.Popen')
+
+    prepare_mock._abort()
+
+    assert prepare_mock._run_shell_task('sleep 10') is None
+    assert prepare_mock._copy_from_cmd('sleep 10', 'COPY t FROM STDIN') is None
+    popen.assert_not_called()
+
+
+def test_abort_cancels_pooled_statements(mocker, prepare_mock):
+    cancel = mocker.patch.object(prepare_mock.conn_pool, 'cancel')
+
+    prepare_mock._abort()
+
+    assert prepare_mock.cancel_event.is_set()
+    cancel.assert_called_once()
+
+
+def sleeping_loader(_):
+    time.sleep(10)
+
+
+def failing_loader(_):
+    time.sleep(0.2)
+    raise RuntimeError('boom')
+
+
+def test_run_tasks_parallel_terminates_loader_processes_on_failure(prepare_mock):
+    prepare_mock.args.max_jobs = 2
+
+    with pytest.raises(SystemExit):
+        prepare_mock._run_tasks_parallel([(sleeping_loader, None), (failing_loader, None)],
+                                         executor_class=ProcessPoolExecutor)
+
+    # The busy loader must be gone long before it would have finished
+    deadline = time.time() + 5
+    while multiprocessing.active_children() and time.time() < deadline:
+        time.sleep(0.05)
+    assert not multiprocessing.active_children()
+
+
+def test_vacuum_analyze_runs_on_pooled_connections(mocker, prepare_mock):
+    mocker.patch.object(PrepareBenchmarkFactory, 'TABLES', (TableGroup('a', 'b', 'c'), TableGroup('d', 'e')))
+    mocker.patch.object(PrepareBenchmarkFactory, 'TABLES_ANALYZE', None)
+    run_tasks = mocker.patch.object(prepare_mock, '_run_tasks_parallel')
+
+    prepare_mock.vacuum_analyze()
+
+    vacuum_tasks, analyze_tasks = (call[0][0] for call in run_tasks.call_args_list)
+    assert vacuum_tasks == [prepare_mock.pooled_exec_cmd(f'VACUUM {table}') for table in 'abcde']
+    assert analyze_tasks == [prepare_mock.pooled_exec_cmd(f'ANALYZE {table}') for table in 'abcde']
+
+
+def test_pooled_exec_cmd_runs_on_pooled_connection(mocker, prepare_mock):
+    conn = mocker.Mock()
+    mocker.patch.object(prepare_mock.conn_pool, 'checkout', return_value=conn)
+    checkin = mocker.patch.object(prepare_mock.conn_pool, 'checkin')
+
+    task = prepare_mock.pooled_exec_cmd('VACUUM a')
+    task[0](*task[1:])
+
+    conn.cursor.execute.assert_called_once_with('VACUUM a')
+    checkin.assert_called_once_with(conn)
+
+
+def test_add_indexes_passes_index_build_options(mocker, prepare_mock):
+    mocker.patch('os.path.isfile', side_effect=lambda path: path.endswith('/indexes.sql'))
+    mocker.patch('builtins.open', mocker.mock_open(read_data='CREATE INDEX a_idx ON a (x);'))
+    run_tasks = mocker.patch.object(prepare_mock, '_run_tasks_parallel')
+    prepare_mock.args.max_jobs = 4
+    prepare_mock.args.maintenance_work_mem = '2GB'
+    prepare_mock.args.max_parallel_maintenance_workers = 3
+
+    prepare_mock.add_indexes()
+
+    run_tasks.assert_called_once_with([
+        "PGOPTIONS='-c maintenance_work_mem=2GB -c max_parallel_maintenance_workers=3' "
+        f'psql {ArgsMock.dsn} -c "CREATE INDEX a_idx ON a (x);"'
+    ])
+
+
+def index_build_mocks(mocker, prepare_mock, cpus, settings):
+    mocker.patch('os.sysconf', side_effect=lambda name: {'SC_PAGE_SIZE': 4096, 'SC_PHYS_PAGES': 16 << 18}[name])
+    mocker.patch('os.cpu_count', return_value=cpus)
+    mocker.patch.object(prepare_mock, '_current_index_build_settings', return_value=settings)
+    prepare_mock.args.maintenance_work_mem = None
+    prepare_mock.args.max_parallel_maintenance_workers = None
+
+
+def test_index_build_options_split_machine_across_jobs(mocker, prepare_mock):
+    index_build_mocks(mocker, prepare_mock, 16, {'maintenance_work_mem': 64 << 10,
+                                                 'max_parallel_maintenance_workers': 2})
+    prepare_mock.args.max_jobs = 4
+
+    assert prepare_mock._index_build_options() == \
+        '-c maintenance_work_mem=512MB -c max_parallel_maintenance_workers=4'
+
+
+def test_index_build_options_never_lower_server_settings(mocker, prepare_mock):
+    # fewer CPUs than jobs and a DBA who already raised maintenance_work_mem
+    index_build_mocks(mocker, prepare_mock, 4, {'maintenance_work_mem': 1 << 20,
+                                                'max_parallel_maintenance_workers': 2})
+    prepare_mock.args.max_jobs = 8
+
+    assert prepare_mock._index_build_options() == ''
+
+
+def test_index_build_options_keep_postgres_defaults_as_minimum(mocker, prepare_mock):
+    index_build_mocks(mocker, prepare_mock, 4, {'maintenance_work_mem': 16 << 10,
+                                                'max_parallel_maintenance_workers': 0})
+    prepare_mock.args.max_jobs = 8
+    mocker.patch('os.sysconf', side_effect=lambda name: {'SC_PAGE_SIZE': 4096, 'SC_PHYS_PAGES': 1 << 18}[name])
+
+    assert prepare_mock._index_build_options() == \
+        '-c maintenance_work_mem=64MB -c max_parallel_maintenance_workers=2'
+
+
+def test_index_build_options_skip_workers_before_postgres_11(mocker, prepare_mock):
+    index_build_mocks(mocker, prepare_mock, 16, {'maintenance_work_mem': 64 << 10})
+    prepare_mock.args.max_jobs = 4
+
+    assert prepare_mock._index_build_options() == '-c maintenance_work_mem=512MB'
+
+
+def test_add_indexes_without_index_build_options(mocker, prepare_mock):
+    mocker.patch('os.path.isfile', side_effect=lambda path: path.endswith('/indexes.sql'))
+    mocker.patch('builtins.open', mocker.mock_open(read_data='CREATE INDEX a_idx ON a (x);'))
+    mocker.patch.object(prepare_mock, '_index_build_options', return_value='')
+    run_tasks = mocker.patch.object(prepare_mock, '_run_tasks_parallel')
+
+    prepare_mock.add_indexes()
+
+    run_tasks.assert_called_once_with([f'psql {ArgsMock.dsn} -c "CREATE INDEX a_idx ON a (x);"'])
+
+
+def test_load_schema_streams_file_through_psql(mocker, prepare_mock):
+    run_shell_task = mocker.patch.object(prepare_mock, '_run_shell_task')
+
+    prepare_mock._load_schema('/tmp/applied_schema.sql')
+
+    run_shell_task.assert_called_once_with(
+        f'psql {ArgsMock.dsn} -f /tmp/applied_schema.sql -q -v ON_ERROR_STOP=1')
+
+
+def test_run_tasks_parallel_starts_heaviest_tasks_first(prepare_mock):
+    prepare_mock.args.max_jobs = 1
+    executed = []
+
+    tasks = [(executed.append, name) for name in ('small', 'big-1', 'medium', 'big-2')]
+    prepare_mock._run_tasks_parallel(tasks, weights=[1, 50, 10, 50])
+
+    assert executed[2:] == ['medium', 'small']
+    assert sorted(executed[:2]) == ['big-1', 'big-2']
+
+
+class CursorMock:
+    def __init__(self):
+        self.copied = []
+        self.rowcount = -1
+
+    def copy_expert(self, sql, stream, size=8192):
+        data = stream.read().decode('utf-8')
+        self.copied.append((sql, data))
+        self.size = size
+        self.rowcount = len(data.splitlines())
+
+
+class DBConnMock:
+    def __init__(self):
+        self.cursor = CursorMock()
+
+
+def test_copy_from_cmd_streams_generator_into_pooled_connection(mocker, tmp_path, prepare_mock):
+    prepare_mock.benchmark = Benchmark('foobar', str(tmp_path))
+    conn = DBConnMock()
+    mocker.patch.object(prepare_mock.conn_pool, 'checkout', return_value=conn)
+    checkin = mocker.patch.object(prepare_mock.conn_pool, 'checkin')
+
+    task = prepare_mock.copy_from_cmd("printf '1|a\\n2|b\\n'", "COPY t FROM STDIN WITH DELIMITER '|'")
+    assert task[0](*task[1:]) == 'COPY 2'
+
+    assert conn.cursor.copied == [("COPY t FROM STDIN WITH DELIMITER '|'", '1|a\n2|b\n')]
+    assert conn.cursor.size == 1 << 20
+    checkin.assert_called_once_with(conn)
+
+
+@pytest.mark.parametrize('cmd', ['exit 3', 'false | cat'])
+def test_copy_from_cmd_fails_if_generator_fails(mocker, tmp_path, prepare_mock, cmd):
+    prepare_mock.benchmark = Benchmark('foobar', str(tmp_path))
+    mocker.patch.object(prepare_mock.conn_pool, 'checkout', return_value=DBConnMock())
+    mocker.patch.object(prepare_mock.conn_pool, 'checkin')
+
+    with pytest.raises(SystemExit):
+        prepare_mock._copy_from_cmd(cmd, 'COPY t FROM STDIN')
+    assert prepare_mock.cancel_event.is_set()
+
+
+def test_copy_from_cmd_kills_generator_if_checkout_fails(mocker, tmp_path, prepare_mock):
+    prepare_mock.benchmark = Benchmark('foobar', str(tmp_path))
+    mocker.patch.object(prepare_mock.conn_pool, 'checkout', side_effect=RuntimeError('no connection'))
+    checkin = mocker.patch.object(prepare_mock.conn_pool, 'checkin')
+
+    with pytest.raises(RuntimeError):
+        prepare_mock._copy_from_cmd('sleep 10', 'COPY t FROM STDIN')
+    checkin.assert_not_called()
+    assert not prepare_mock._processes
+
+
+def test_copy_from_cmd_skips_checkout_if_generator_cannot_start(mocker, tmp_path, prepare_mock):
+    prepare_mock.benchmark = Benchmark('foobar', str(tmp_path / 'missing'))
+    checkout = mocker.patch.object(prepare_mock.conn_pool, 'checkout')
+
+    with pytest.raises(FileNotFoundError):
+        prepare_mock._copy_from_cmd('true', 'COPY t FROM STDIN')
+    checkout.assert_not_called()
+
+
+def test_table_weight_uses_data_file_sizes(tmp_path, prepare_mock):
+    (tmp_path / 'customer.1.gz').write_bytes(b'x' * 10)
+    (tmp_path / 'customer.2.gz').write_bytes(b'x' * 5)
+    (tmp_path / 'customer_address.1.gz').write_bytes(b'x' * 7)
+    (tmp_path / 'ignored_dir').mkdir()
+    prepare_mock.data_dir = str(tmp_path)
+
+    prepare_mock._data_file_sizes = prepare_mock._scan_data_file_sizes()
+
+    assert prepare_mock.get_table_weight('customer') == 15
+    assert prepare_mock.get_table_weight('customer_address') == 7
+    assert prepare_mock.get_table_weight('store_sales') == 0
+
+
+def test_table_weight_falls_back_if_data_dir_is_missing(mocker, tmp_path, prepare_mock):
+    mocker.patch('os.path.isdir', return_value=False)
+    mocker.patch.object(PrepareBenchmarkFactory, 'TABLE_WEIGHTS', {'customer': 3})
+    prepare_mock.data_dir = str(tmp_path / 'missing')
+
+    prepare_mock._data_file_sizes = prepare_mock._scan_data_file_sizes()
+
+    assert prepare_mock.get_table_weight('customer') == 3